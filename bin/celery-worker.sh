@@ -2,4 +2,8 @@
 
 source ~/venv/bin/activate
 cd ~/src
+# metrics of all worker processes are collected through this directory
+export PROMETHEUS_MULTIPROC_DIR=~/tmp/prometheus
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 celery worker -A app.celery -Q urbanecm_wiki_importer --loglevel=info
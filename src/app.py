@@ -19,18 +19,36 @@ import yaml
 from flask import redirect, request, jsonify, render_template, url_for, \
     make_response, flash, session
 from flask import Flask
+import billiard
+import redis
 import requests
 import subprocess
 from flask_jsonlocale import Locales
 from flask_mwoauth import MWOAuth
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from celery import Celery
-from requests_oauthlib import OAuth1
+from sqlalchemy.exc import IntegrityError
+from celery import Celery, chord
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 import shutil
 import hashlib
 import simplejson as json
 import re
+import threading
+import time
+import traceback
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from cleaner import ExportTransformer, WikiCleaner
+from client import HttpClient, MultipartBody, backoff_delay, get_retry_after
+from cache import ExportCache
+from progress import ImportProgress
+from scheduler import RedisSemaphore, WikiScheduler
+from storage import ExportChain, ExportSlice, get_suffix, open_dump, open_export, scan_export_page
+from metrics import API_RETRIES, DOWNLOADED_BYTES, PAGES, QUEUE_DEPTH, UPLOADED_BYTES, \
+    count_bytes, mark_process_dead, start_metrics_server, track_request, write_metrics_file
 
 app = Flask(__name__, static_folder='../static')
 
@@ -40,11 +58,30 @@ migrate = Migrate(app, db)
 ALLOWED_GROUPS = ['new-wikis-importer', 'steward']
 useragent = 'WikiImporter (tools.wiki-importer@tools.wmflabs.org)'
 
-s = requests.Session()
-s.headers.update({'User-Agent': useragent})
-
 NS_MAIN = 0
 
+# createlocalaccount errors for accounts that are there already
+ACCOUNT_EXISTS_ERRORS = ('centralauth-createlocal-already-exists', 'userexists')
+
+# Approximate size of the metadata of one revision in an export
+REVISION_XML_BYTES = 400
+
+# Paths served without login and privilege checks
+PUBLIC_PATHS = ['/login', '/oauth-callback', '/healthz']
+
+# Endpoints polled by pages, served without touching the database
+NO_DB_ENDPOINTS = ['wiki_progress']
+
+# (token type, API URL, user id) -> token, kept for the duration of a task
+token_cache = {}
+
+# Processes cleaning revision texts, see get_clean_pool()
+clean_pool = None
+clean_pool_lock = threading.Lock()
+
+# dbname -> ImportBatchSizer, kept for the lifetime of the worker process
+import_sizers = {}
+
 # Load configuration from YAML file
 __dir__ = os.path.dirname(__file__)
 app.config.update(
@@ -55,6 +92,37 @@ app.config.update(
 if app.config.get('DBCONFIG_FILE') is not None:
     app.config['SQLALCHEMY_DATABASE_URI'] = app.config.get('DB_URI') + '?read_default_file={cfile}'.format(cfile=app.config.get('DBCONFIG_FILE'))
 
+client = HttpClient(
+    useragent,
+    app.config.get('HTTP_POOL_CONNECTIONS', 10),
+    app.config.get('HTTP_POOL_MAXSIZE', 10),
+    app.config.get('HTTP_MAX_PER_HOST', 4),
+    # a read timeout applies to each read of a streamed export, not to the
+    # whole download
+    (app.config.get('HTTP_CONNECT_TIMEOUT', 10), app.config.get('HTTP_READ_TIMEOUT', 300))
+)
+
+# Shared by ImportProgress and the scheduler
+redis_client = redis.Redis.from_url(app.config.get(
+    'REDIS_URL',
+    app.config.get('CELERY_BROKER_URL')
+))
+
+# Import chunks of all wikis share the worker slots fairly
+scheduler = WikiScheduler(
+    redis_client,
+    app.config.get('SCHEDULER_SLOTS', 4),
+    app.config.get('SCHEDULER_LEASE', 3600)
+)
+
+# Requests to Incubator are capped across all workers
+client.host_limits['incubator.wikimedia.org'] = RedisSemaphore(
+    redis_client,
+    'wiki_importer:hosts:incubator',
+    app.config.get('INCUBATOR_MAX_REQUESTS', 8),
+    app.config.get('INCUBATOR_REQUEST_LEASE', 600)
+)
+
 locales = Locales(app)
 _ = locales.get_message
 
@@ -78,14 +146,37 @@ def make_celery():
         queue = 'urbanecm_wiki_importer'
 
         def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return self.run(*args, **kwargs)
+            token_cache.clear()
+            try:
+                with app.app_context():
+                    return self.run(*args, **kwargs)
+            finally:
+                token_cache.clear()
 
     celery.Task = ContextTask
     return celery
 
 celery = make_celery()
 
+@worker_init.connect
+def start_worker_metrics(**kwargs):
+    if app.config.get('METRICS_PORT'):
+        start_metrics_server(app.config.get('METRICS_PORT'))
+
+@worker_process_shutdown.connect
+def remove_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid)
+
+@worker_process_init.connect
+def start_clean_pool(**kwargs):
+    # fork the cleaning processes before any task thread is running
+    get_clean_pool()
+
+@worker_process_shutdown.connect
+def stop_clean_pool(**kwargs):
+    if clean_pool is not None:
+        clean_pool.terminate()
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(255))
@@ -94,12 +185,102 @@ class User(db.Model):
     token_secret = db.Column(db.String(255))
 
 class Page(db.Model):
+    __table_args__ = (
+        db.Index('page_wiki_id_page_title', 'wiki_id', 'page_title', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     wiki_id = db.Column(db.Integer, db.ForeignKey('wiki.id'))
     page_title = db.Column(db.String(255))
     imported_successfully = db.Column(db.Boolean, default=False)
     error_message = db.Column(db.Text, nullable=True)
 
+class PageResultWriter:
+    """Collects import results and writes them to the Page table in batches.
+
+    Rows are flushed every batch_size results or interval seconds, an
+    existing row for the same title is updated instead of duplicated.
+    Flushed results are also counted in progress, if given. Titles with a
+    result or skipped are kept in recorded.
+    """
+
+    def __init__(self, wiki_id, batch_size=50, interval=30, progress=None):
+        self.wiki_id = wiki_id
+        self.batch_size = batch_size
+        self.interval = interval
+        self.progress = progress
+        self.pending = {}
+        self.recorded = set()
+        self.last_flush = time.monotonic()
+
+    def add(self, page_title, imported_successfully, error_message=None):
+        self.recorded.add(page_title)
+        self.pending[page_title] = (imported_successfully, error_message)
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def skip(self, page_titles):
+        # pages not to be imported get no row
+        self.recorded.update(page_titles)
+        if self.progress is not None:
+            self.progress.add(skipped=len(page_titles))
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        existing = {
+            page.page_title: page
+            for page in Page.query.filter(
+                Page.wiki_id == self.wiki_id,
+                Page.page_title.in_(list(self.pending))
+            )
+        }
+        for page_title, (imported_successfully, error_message) in self.pending.items():
+            page = existing.get(page_title)
+            if page is None:
+                page = Page(wiki_id=self.wiki_id, page_title=page_title)
+                db.session.add(page)
+            page.imported_successfully = imported_successfully
+            page.error_message = error_message
+        db.session.commit()
+        if self.progress is not None:
+            done = sum(1 for imported_successfully, error_message in self.pending.values() if imported_successfully)
+            self.progress.add(done=done, failed=len(self.pending) - done)
+        self.pending = {}
+
+class ImportBatchSizer:
+    """Byte and revision budget of one action=import upload.
+
+    The budget starts at a quarter of the maximum, grows while the target
+    wiki imports batches faster than target_seconds and is halved when an
+    import is slower than that or gets no valid response.
+    """
+
+    def __init__(self, max_bytes, max_revisions, target_seconds):
+        self.max_bytes = max_bytes
+        self.max_revisions = max_revisions
+        self.target_seconds = target_seconds
+        self.scale = 0.25
+
+    def fits(self, batch_bytes, batch_revisions):
+        return batch_bytes <= self.max_bytes * self.scale and \
+            batch_revisions <= self.max_revisions * self.scale
+
+    def record(self, seconds, success):
+        if success and seconds < self.target_seconds:
+            self.scale = min(1, self.scale * 1.5)
+        elif not success or seconds > self.target_seconds:
+            # never below the budget of a single small page
+            self.scale = max(0.01, self.scale / 2)
+
+class LocalUser(db.Model):
+    __table_args__ = (
+        db.Index('local_user_wiki_id_username', 'wiki_id', 'username', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    wiki_id = db.Column(db.Integer, db.ForeignKey('wiki.id'))
+    username = db.Column(db.String(255))
+
 class Wiki(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     dbname = db.Column(db.String(255))
@@ -107,50 +288,49 @@ class Wiki(db.Model):
     prefix = db.Column(db.String(255))
     is_imported = db.Column(db.Boolean, default=False)
     import_started = db.Column(db.Boolean, default=False)
+    import_phase = db.Column(db.Integer, default=0)
+    import_namespace = db.Column(db.Integer, nullable=True)
+    import_continue = db.Column(db.Text, nullable=True)
+    import_last_title = db.Column(db.String(255), nullable=True)
+    import_priority = db.Column(db.Integer, default=1)
     is_wiktionary = False
     namespaces = None
+    _cleaner = None
+    _path = None
+    _export_cache = None
 
     def __str__(self):
         return self.dbname
     
-    def get_colon_pages(self, namespace=NS_MAIN, user=None):
-        pagesAll = self.get_pages(namespace, user)
-        pages = []
-        for page in pagesAll:
-            if ':' in page:
-                pages.append(page)
-        return pages
-    
-    def get_noncolon_pages(self, namespace=NS_MAIN, user=None):
-        pagesAll = self.get_pages(namespace, user)
-        pages = []
-        for page in pagesAll:
-            if ':' not in page:
-                pages.append(page)
-        return pages
-    
-    def get_pages(self, namespace=NS_MAIN, user=None):
+    def get_noncolon_pages(self, pages):
+        return [page for page in pages if ':' not in page]
+
+    def get_pages_batch(self, namespace=NS_MAIN, user=None, cont=None):
+        # One allpages request, returns the titles and the continue
+        # parameters of the next batch (None after the last one)
         payload = {
             "action": "query",
             "format": "json",
             "list": "allpages",
-            "aplimit": "max",
+            "aplimit": app.config.get('ENUMERATION_LIMIT', 'max'),
             "apprefix": "%s/" % self.prefix,
             "apnamespace": namespace
         }
-        res = []
-        while True:
-            data = mw_request(payload, app.config.get('INCUBATOR_API'), user).json()
-            pages = data.get('query').get('allpages')
-            for page in pages:
-                res.append(page.get('title'))
-            
-            if data.get('continue'):
-                for param in data.get('continue'):
-                    payload[param] = data['continue'].get(param)
-            else:
-                break
-        return res
+        if cont:
+            payload.update(cont)
+        data = mw_request(payload, app.config.get('INCUBATOR_API'), user).json()
+        pages = [page.get('title') for page in data.get('query').get('allpages')]
+        return pages, data.get('continue')
+
+    def get_imported_pages(self, page_titles):
+        return set(
+            page.page_title
+            for page in Page.query.filter(
+                Page.wiki_id == self.id,
+                Page.imported_successfully.is_(True),
+                Page.page_title.in_(page_titles)
+            )
+        )
 
     def get_namespaces(self):
         if not self.namespaces:
@@ -172,99 +352,457 @@ class Wiki(db.Model):
             self.namespaces = namespaces
         return self.namespaces
 
+    @property
+    def cleaner(self):
+        if self._cleaner is None:
+            namespaces = self.get_namespaces()
+            self._cleaner = WikiCleaner(self.prefix, self.is_wiktionary, namespaces)
+        return self._cleaner
+
     def clean_line(self, line):
-        prefix = self.prefix
-        prefix = "[" + prefix[0].upper() + prefix[0].lower() + "]" + prefix[1:]
-        # Replace all instances of the prefix + trailing slash
-        line = re.sub(r" *(?i:" + prefix + r")/", "", line)
-        if not self.is_wiktionary:
-            # Turn [[Abc|abc]] into [[abc]]
-            line = re.sub(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)\ *\]\]", r"[[\3]]", line)
-            # Turn [[Abc|abcdef]] into [[abc]]def
-            line = re.sub(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)(\w+) *\]\]", r"[[\3]]\4", line)
-        else:
-            # Turn [[abc|abc]] into [[abc]]
-            line = re.sub(r"\[\[ *(.*?) *\| *\1 *\]\]", r"[[\1]]", line)
-            # Turn [[abc|abcdef]] into [[abc]]def
-            line = re.sub(r"\[\[ *(.*?) *\| *\1(\w+) *\]\]", r"[[\1]]\2", line)
-        # Remove the base category
-        line = re.sub(r"\[\[ *[Cc]ategory *: *" + prefix + r".*?\]\]\n?", "", line)
-        # Remove {{PAGENAME}} category sortkeys, and one-letter-only sortkeys
-        line = re.sub(r"\[\[ *[Cc]ategory *: *(.+?)\|{{(SUB)?PAGENAME}} *\]\]", r"[[Category:\1]]", line)
-        line = re.sub(r"\[\[ *[Cc]ategory *: *(.+?)\|\w *\]\]", r"[[Category:\1]]", line)
-        # Translate namespaces
-        self.get_namespaces()
-        for key in self.namespaces:
-            key_regex = r"[" + key[0].upper() + key[0].lower() + r"]" + key[1:]
-            line = re.sub(r"\[\[ *" + key_regex + r" *: *([^\|\]])", r"[[" + self.namespaces[key] + r":\1", line)
-        return line
-
-    def get_singlepage_xml_from_incubator(self, page_title):
-        r = s.get('https://incubator.wikimedia.org/wiki/Special:Export/%s?history=1' % (
+        return self.cleaner.clean_line(line)
+
+    def export_transformer(self):
+        return ExportTransformer(
+            self.cleaner,
+            get_clean_pool(),
+            app.config.get('CLEAN_CHUNK_BYTES', 1024 * 1024),
+            app.config.get('CLEAN_MAX_PENDING_BYTES', 16 * 1024 * 1024)
+        )
+
+    @property
+    def export_cache(self):
+        if self._export_cache is None:
+            self._export_cache = ExportCache(
+                self.path,
+                app.config.get('EXPORT_CACHE_BYTES', 1024 * 1024 * 1024),
+                get_suffix(app.config.get('EXPORT_COMPRESSION', 'gzip')),
+                app.config.get('EXPORT_CACHE_LEASE', 600)
+            )
+        return self._export_cache
+
+    def tmp_path(self, name):
+        # Files being written, kept out of the export cache directory
+        path = os.path.join(self.path, 'tmp')
+        os.makedirs(path, exist_ok=True)
+        return os.path.join(path, '%s.%d.%d.tmp' % (name, os.getpid(), threading.get_ident()))
+
+    def page_path(self, page_title, revid=None):
+        return self.export_cache.path(page_title, revid)
+
+    def get_singlepage_xml_from_incubator(self, page_title, revid=None):
+        path = self.page_path(page_title, revid)
+        tmp_path = self.tmp_path('export')
+        url = 'https://incubator.wikimedia.org/wiki/Special:Export/%s?history=1' % (
             page_title,
-        ))
-        path = os.path.join(self.path, '%s.xml' % hashlib.md5(page_title.encode('utf-8')).hexdigest())
-        f = open(path, 'w')
-        for line in r.content.decode('utf-8').split('\n'):
-            line = line + "\n"
-            f.write(self.clean_line(line))
-        f.close()
+        )
+        host = urlparse(url).netloc
+        with client.slot(url), client.limit(url), track_request(host, 'export'), client.get(url, stream=True) as r:
+            with open_export(tmp_path, app.config.get('EXPORT_COMPRESSION', 'gzip')) as f:
+                chunks = r.iter_content(chunk_size=app.config.get('EXPORT_CHUNK_SIZE', 65536))
+                chunks = count_bytes(chunks, DOWNLOADED_BYTES.labels(host))
+                for event in self.export_transformer().transform(chunks):
+                    if event[0] == 'text':
+                        f.write(event[1])
+        os.replace(tmp_path, path)
+        self.export_cache.add(path)
         return path
 
-    def page_exists(self, page_title, user):
-        r = mw_request({
-            "action": "query",
-            "format": "json",
-            "titles": page_title.replace(' ', '_')
-        }, self.api_url, user)
-        data = r.json().get('query', {}).get('pages', {})
+    def get_multipage_xml_from_incubator(self, page_titles):
+        # Export all pages with one request and split the combined XML into
+        # one file per page
+        url = 'https://incubator.wikimedia.org/wiki/Special:Export'
+        host = urlparse(url).netloc
+        with client.slot(url), client.limit(url), track_request(host, 'export'), client.post(url, data={
+            'pages': '\n'.join(page_titles),
+            'history': '1',
+            'action': 'submit'
+        }, stream=True) as r:
+            chunks = r.iter_content(chunk_size=app.config.get('EXPORT_CHUNK_SIZE', 65536))
+            return self.split_export(count_bytes(chunks, DOWNLOADED_BYTES.labels(host)))
+
+    def stage_dump(self, dump_path, namespaces):
+        # Clean pages of this wiki from a local Incubator XML dump into the
+        # export cache, so they do not need to be exported from Incubator
+        prefix = '%s/' % self.prefix
+
+        def wanted(page_title, namespace):
+            if namespace not in namespaces:
+                return False
+            if namespace != NS_MAIN:
+                page_title = page_title.split(':', 1)[-1]
+            return page_title.startswith(prefix)
+
+        chunk_size = app.config.get('EXPORT_CHUNK_SIZE', 65536)
+        with open_dump(dump_path) as f:
+            paths = self.split_export(iter(lambda: f.read(chunk_size), b''), wanted)
+        for path in paths.values():
+            self.export_cache.release(path)
+        return paths
+
+    def split_export(self, chunks, wanted=None):
+        # Write every page of an export (or dump) to its own cleaned file
+        # with a copy of the header, keyed by its title and the id of its
+        # last revision. wanted(title, namespace) can filter the pages.
+        compression = app.config.get('EXPORT_COMPRESSION', 'gzip')
+        paths = {}
+        header = []
+        header_done = False
+        page_text = None
+        page_title = None
+        revid = None
+        f = None
+        tmp_path = self.tmp_path('split')
         try:
-            page_id = list(data.keys())[0]
-        except IndexError:
-            print('Failed existance check for page_title=%s' % page_title)
-            raise
-        page_data = data[page_id]
-        return 'missing' not in page_data
+            for event in self.export_transformer().transform(chunks, wanted):
+                if event[0] == 'text':
+                    if f is not None:
+                        f.write(event[1])
+                    elif page_text is not None:
+                        page_text.append(event[1])
+                    elif not header_done:
+                        header.append(event[1])
+                elif event[0] == 'page_start':
+                    header_done = True
+                    page_text = []
+                    revid = None
+                elif event[0] == 'page_info':
+                    # title and namespace are needed before deciding on the page
+                    page_title = event[1]
+                    if wanted is None or wanted(page_title, event[2]):
+                        f = open_export(tmp_path, compression)
+                        f.writelines(header)
+                        f.writelines(page_text)
+                    page_text = None
+                elif event[0] == 'revision':
+                    revid = event[1]
+                elif event[0] == 'page_end':
+                    page_text = None
+                    if f is not None:
+                        f.write('\n</mediawiki>\n')
+                        f.close()
+                        f = None
+                        paths[page_title] = self.page_path(page_title, revid)
+                        os.replace(tmp_path, paths[page_title])
+                        self.export_cache.add(paths[page_title])
+        finally:
+            if f is not None:
+                # truncated response or broken XML, do not leave a partial
+                # export behind
+                f.close()
+                os.remove(tmp_path)
+        return paths
 
-    def get_user_names_incubator(self, page_title, user):
-        r = mw_request({
-            "action": "query",
-            "format": "json",
-            "prop": "revisions",
-            "titles": page_title,
-            "rvprop": "user",
-            "rvlimit": "max"
-        }, app.config.get('INCUBATOR_API'), user)
-        data = r.json()['query']['pages']
+    def get_page_info(self, page_titles, user):
+        # Current length and latest revision id of pages on Incubator
+        info = {}
+        for i in range(0, len(page_titles), 50):
+            data = mw_request({
+                "action": "query",
+                "format": "json",
+                "prop": "info",
+                "titles": "|".join(page_titles[i:i + 50])
+            }, app.config.get('INCUBATOR_API'), user).json()
+            for page in data.get('query', {}).get('pages', {}).values():
+                info[page.get('title')] = page
+        return info
+
+    def get_export_batches(self, page_titles, info):
+        # Group titles by page count and by the estimated size of their
+        # history exports. The estimate comes from the current length in
+        # the page info fetched for all titles anyway, sizing must not cost
+        # a request per title. Exports are streamed, so a batch above the
+        # budget is only slower.
+        max_pages = app.config.get('EXPORT_BATCH_PAGES', 50)
+        max_bytes = app.config.get('EXPORT_BATCH_BYTES', 50 * 1024 * 1024)
+        revisions = app.config.get('EXPORT_REVISIONS_ESTIMATE', 10)
+        batch = []
+        batch_bytes = 0
+        for page_title in page_titles:
+            length = (info.get(page_title, {}).get('length', 0) + REVISION_XML_BYTES) * revisions
+            if batch and (len(batch) >= max_pages or batch_bytes + length > max_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(page_title)
+            batch_bytes += length
+        if batch:
+            yield batch
+
+    def get_existing_pages(self, page_titles, user):
+        # Check titles on the target wiki in batches, returns the set of
+        # titles (as passed in) that already exist there
+        existing = set()
+        batch_size = app.config.get('QUERY_BATCH_SIZE', 50)
+        for i in range(0, len(page_titles), batch_size):
+            data = mw_request({
+                "action": "query",
+                "format": "json",
+                "titles": "|".join(page_titles[i:i + batch_size])
+            }, self.api_url, user).json().get('query', {})
+            normalized = {}
+            for item in data.get('normalized', []):
+                normalized.setdefault(item['to'], []).append(item['from'])
+            for page_data in data.get('pages', {}).values():
+                if 'missing' in page_data:
+                    continue
+                title = page_data.get('title')
+                existing.add(title)
+                existing.update(normalized.get(title, []))
+        return existing
+
+    def get_latest_revisions(self, page_titles, api_url, user):
+        # Timestamp of the latest revision of every existing page, keyed by
+        # the titles as passed in
+        revisions = {}
+        batch_size = app.config.get('QUERY_BATCH_SIZE', 50)
+        for i in range(0, len(page_titles), batch_size):
+            data = mw_request({
+                "action": "query",
+                "format": "json",
+                "prop": "revisions",
+                "titles": "|".join(page_titles[i:i + batch_size]),
+                "rvprop": "timestamp"
+            }, api_url, user).json().get('query', {})
+            normalized = {}
+            for item in data.get('normalized', []):
+                normalized.setdefault(item['to'], []).append(item['from'])
+            for page_data in data.get('pages', {}).values():
+                if 'missing' in page_data or not page_data.get('revisions'):
+                    continue
+                title = page_data.get('title')
+                revision = page_data['revisions'][0]
+                for page_title in [title] + normalized.get(title, []):
+                    revisions[page_title] = revision
+        return revisions
+
+    def get_changed_pages(self, pages, target_titles, user):
+        # Pages missing on the target wiki, or whose Incubator history moved
+        # past the latest revision imported there. Imported texts are
+        # cleaned, so their content hashes never match Incubator's.
+        incubator = self.get_latest_revisions(pages, app.config.get('INCUBATOR_API'), user)
+        target = self.get_latest_revisions(sorted(set(target_titles.values())), self.api_url, user)
+        changed = []
+        for page in pages:
+            source_rev = incubator.get(page)
+            target_rev = target.get(target_titles[page])
+            if source_rev is None:
+                continue
+            if target_rev is None or source_rev['timestamp'] > target_rev['timestamp']:
+                changed.append(page)
+        return changed
+
+    def get_authors_incubator(self, page_titles, user):
+        # Registered contributors of all given pages, anonymous edits can't
+        # be attributed to a local account anyway
         users = set()
-        revs = data[list(data.keys())[0]]['revisions']
-        for rev in revs:
-            users.add(rev['user'])
+        batch_size = app.config.get('QUERY_BATCH_SIZE', 50)
+        for i in range(0, len(page_titles), batch_size):
+            payload = {
+                "action": "query",
+                "format": "json",
+                "prop": "contributors",
+                "titles": "|".join(page_titles[i:i + batch_size]),
+                "pclimit": "max"
+            }
+            while True:
+                data = mw_request(payload, app.config.get('INCUBATOR_API'), user).json()
+                for page_data in data.get('query', {}).get('pages', {}).values():
+                    for contributor in page_data.get('contributors', []):
+                        users.add(contributor['name'])
+
+                if data.get('continue'):
+                    for param in data.get('continue'):
+                        payload[param] = data['continue'].get(param)
+                else:
+                    break
         return users
 
-    def import_pages(self, pages, user):
-        for page in pages:
-            if self.page_exists(page.replace('%s/' % self.prefix, ''), user):
-                # skip existing pages
+    def create_local_accounts(self, page_titles, user):
+        authors = self.get_authors_incubator(page_titles, user)
+        if not authors:
+            return
+        created = set(
+            local_user.username
+            for local_user in LocalUser.query.filter(
+                LocalUser.wiki_id == self.id,
+                LocalUser.username.in_(list(authors))
+            )
+        )
+        users = authors - created
+        if not users:
+            return
+        for user_name in sorted(users):
+            resp = mw_request({
+                "action": "createlocalaccount",
+                "format": "json",
+                "username": user_name,
+                "reason": "force-creating local user before import",
+                # cached, and refreshed for all accounts after a badtoken
+                "token": get_token('csrf', self.api_url, user)
+            }, self.api_url, user).json()
+            # accounts that exist already are remembered like created ones
+            if 'error' in resp and resp['error'].get('code') not in ACCOUNT_EXISTS_ERRORS:
+                print('Failed to create local account for %s: %s' % (user_name, json.dumps(resp)))
                 continue
+            try:
+                with db.session.begin_nested():
+                    db.session.add(LocalUser(
+                        wiki_id=self.id,
+                        username=user_name
+                    ))
+            except IntegrityError:
+                # recorded by a chunk running in parallel
+                pass
+        db.session.commit()
 
-            users = self.get_user_names_incubator(page, user)
-            token = get_token('csrf', self.api_url, user)
-            for user_name in users:
-                mw_request({
-                    "action": "createlocalaccount",
-                    "format": "json",
-                    "username": user_name,
-                    "reason": "force-creating local user before import",
-                    "token": token
-                }, self.api_url, user)
-            file_path = self.get_singlepage_xml_from_incubator(page)
+    def import_pages(self, pages, user, reconcile=False):
+        # pages can be any iterable, each chunk is imported as soon as it
+        # was read from it
+        results = PageResultWriter(
+            self.id,
+            app.config.get('RESULTS_BATCH_SIZE', 50),
+            app.config.get('RESULTS_FLUSH_INTERVAL', 30),
+            self.progress
+        )
+        try:
+            for chunk in chunked(pages, app.config.get('IMPORT_CHUNK_SIZE', 100)):
+                try:
+                    self.import_chunk(chunk, user, results, reconcile)
+                except Exception as e:
+                    # the pages still count as processed, so done, skipped
+                    # and failed add up to planned
+                    print('Failed to import a chunk of %d pages to %s' % (len(chunk), self.dbname))
+                    traceback.print_exc()
+                    db.session.rollback()
+                    failed = [page for page in chunk if page not in results.recorded]
+                    for page in failed:
+                        results.add(page, False, '%s: %s' % (type(e).__name__, e))
+                    PAGES.labels(self.dbname, 'failed').inc(len(failed))
+        finally:
+            results.flush()
+
+    def import_chunk(self, pages, user, results, reconcile=False):
+        target_titles = {page: page.replace('%s/' % self.prefix, '') for page in pages}
+        if reconcile:
+            # re-import pages with new revisions on Incubator
+            pages = self.get_changed_pages(pages, target_titles, user)
+        else:
+            # skip existing pages
+            existing = self.get_existing_pages(sorted(set(target_titles.values())), user)
+            pages = [page for page in pages if target_titles[page] not in existing]
+        PAGES.labels(self.dbname, 'skipped').inc(len(target_titles) - len(pages))
+        kept = set(pages)
+        results.skip([page for page in target_titles if page not in kept])
+        self.create_local_accounts(pages, user)
+        self.import_batches(pages, user, results)
+
+    def import_batches(self, pages, user, results):
+        info = self.get_page_info(pages, user)
+        revids = {page: info.get(page, {}).get('lastrevid') for page in pages}
+
+        # exports of the same revisions downloaded by an earlier run
+        cached = {}
+        for page in pages:
+            path = self.export_cache.get(page, revids[page])
+            if path is not None:
+                cached[page] = path
+        if cached:
+            self.import_batch(list(cached), cached, user, results)
+        pages = [page for page in pages if page not in cached]
+
+        batches = self.get_export_batches(pages, info)
+        workers = app.config.get('PREFETCH_WORKERS', 2)
+        if not workers:
+            for batch in batches:
+                self.import_batch(batch, self.get_multipage_xml_from_incubator(batch), user, results)
+            return
+
+        # Download and clean the next batches while the current one is being
+        # imported. Export threads must not touch expired model attributes,
+        # so resolve everything they need here.
+        self.export_cache
+        self.cleaner
+        lookahead = app.config.get('PREFETCH_BATCHES', 2)
+        pending = deque()
+        queue_depth = QUEUE_DEPTH.labels(self.dbname)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in batches:
+                pending.append((batch, executor.submit(self.get_multipage_xml_from_incubator, batch)))
+                queue_depth.inc()
+                if len(pending) > lookahead:
+                    batch, future = pending.popleft()
+                    queue_depth.dec()
+                    self.import_batch(batch, future.result(), user, results)
+            while pending:
+                batch, future = pending.popleft()
+                queue_depth.dec()
+                self.import_batch(batch, future.result(), user, results)
+
+    def import_batch(self, batch, paths, user, results):
+        # Import the pages of an export batch with as few uploads as the
+        # budget of the target wiki allows
+        files = {}
+        for page in batch:
+            file_path = paths.get(page)
+            if file_path is not None:
+                try:
+                    # renew the lease of the file until it is uploaded
+                    self.export_cache.touch(file_path)
+                except FileNotFoundError:
+                    # evicted by another worker since
+                    file_path = None
+            if file_path is None:
+                file_path = self.get_singlepage_xml_from_incubator(page)
+            files[page] = file_path
+        try:
             if app.config.get('SKIP_IMPORT', False):
-                print('DRY-RUN: Importing {page} using {xml} as input XML'.format(
-                    page=page,
-                    xml=file_path
-                ))
-                continue
+                for page in batch:
+                    print('DRY-RUN: Importing {page} using {xml} as input XML'.format(
+                        page=page,
+                        xml=files[page]
+                    ))
+                    PAGES.labels(self.dbname, 'dry-run').inc()
+                return
+
+            sizer = get_import_sizer(self.dbname)
+            group = []
+            group_bytes = 0
+            group_revisions = 0
+            for page in batch:
+                located = scan_export_page(files[page])
+                if located is None:
+                    results.add(page, False, "Page is missing from the export")
+                    PAGES.labels(self.dbname, 'failed').inc()
+                    continue
+                start, end, revisions = located
+                if group and not sizer.fits(group_bytes + end - start, group_revisions + revisions):
+                    self.import_group(group, user, results, sizer)
+                    group = []
+                    group_bytes = 0
+                    group_revisions = 0
+                group.append((page, files[page], start, end))
+                group_bytes += end - start
+                group_revisions += revisions
+            if group:
+                self.import_group(group, user, results, sizer)
+        finally:
+            for file_path in files.values():
+                self.export_cache.release(file_path)
+
+    def import_group(self, group, user, results, sizer):
+        # One action=import upload of (page, export path, page start, page
+        # end) tuples, streamed from the export files as the header of the
+        # first one and the <page> elements of all. If it fails, both halves
+        # are imported separately until the failing pages are isolated.
+        parts = [ExportSlice(group[0][1], 0, group[0][2])]
+        for page, path, page_start, page_end in group:
+            # keep other workers from evicting the file during the upload
+            self.export_cache.touch(path)
+            parts.append(ExportSlice(path, page_start, page_end))
+        parts.append(b'</mediawiki>\n')
+        start = time.monotonic()
+        with ExportChain(parts) as f:
             r = mw_request({
                 "action": "import",
                 "token": get_token('csrf', self.api_url, user),
@@ -274,40 +812,47 @@ class Wiki(db.Model):
             }, self.api_url, user, {
                 'xml': (
                     'file.xml',
-                    open(file_path)
+                    f
                 )
             })
-            try:
-                resp = r.json()
-            except:
-                page_obj = Page(
-                    wiki_id=self.id,
-                    page_title=page,
-                    imported_successfully=False,
-                    error_message="Failed to decode server response"
-                )
-                db.session.add(page_obj)
-                db.session.commit()
-                continue
-            import_success = 'error' not in resp
-            page_obj = Page(
-                wiki_id=self.id,
-                page_title=page,
-                imported_successfully=import_success,
-                error_message=None
-            )
-            if not import_success:
-                page_obj.error_message = json.dumps(resp)
-            
-            db.session.add(page_obj)
-            db.session.commit()
+        try:
+            resp = r.json()
+        except ValueError:
+            resp = None
+        # the import result lists every page of the upload in order
+        import_success = resp is not None and 'error' not in resp and \
+            len(resp.get('import') or []) == len(group)
+        # pages failing to import say nothing about the speed of the wiki
+        sizer.record(time.monotonic() - start, resp is not None)
+
+        if import_success:
+            for page, path, page_start, page_end in group:
+                results.add(page, True, None)
+            PAGES.labels(self.dbname, 'imported').inc(len(group))
+        elif len(group) > 1:
+            half = len(group) // 2
+            self.import_group(group[:half], user, results, sizer)
+            self.import_group(group[half:], user, results, sizer)
+        else:
+            results.add(group[0][0], False, "Failed to decode server response" if resp is None else json.dumps(resp))
+            PAGES.labels(self.dbname, 'failed').inc()
+
+    @property
+    def progress(self):
+        return ImportProgress(redis_client, self.dbname)
+
+    def is_import_running(self):
+        # a run whose counters were not updated for a long time died
+        return bool(self.import_started) and \
+            not self.progress.is_stale(app.config.get('IMPORT_STALE_SECONDS', 3600))
 
     @property
     def path(self):
-        path = self.raw_path
-        if not os.path.exists(path):
-            os.mkdir(path)
-        return os.path.abspath(path)
+        if self._path is None:
+            path = self.raw_path
+            os.makedirs(path, exist_ok=True)
+            self._path = os.path.abspath(path)
+        return self._path
 
     @property
     def raw_path(self):
@@ -322,6 +867,35 @@ class Wiki(db.Model):
         return '%s/api.php' % self.url
 
 
+def get_clean_pool():
+    # One pool per worker process, CLEAN_POOL_SIZE: 0 cleans on the
+    # importing thread. billiard can start it from daemonic prefork workers,
+    # where multiprocessing refuses to have children.
+    global clean_pool
+    if not app.config.get('CLEAN_POOL_SIZE', 0):
+        return None
+    with clean_pool_lock:
+        if clean_pool is None:
+            clean_pool = billiard.Pool(app.config.get('CLEAN_POOL_SIZE'))
+    return clean_pool
+
+def get_import_sizer(dbname):
+    if dbname not in import_sizers:
+        import_sizers[dbname] = ImportBatchSizer(
+            app.config.get('IMPORT_BATCH_BYTES', 20 * 1024 * 1024),
+            app.config.get('IMPORT_BATCH_REVISIONS', 2000),
+            app.config.get('IMPORT_BATCH_SECONDS', 30)
+        )
+    return import_sizers[dbname]
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 def logged():
     return mwoauth.get_current_user() is not None
 
@@ -330,12 +904,41 @@ def get_user():
         username=mwoauth.get_current_user()
     ).first()
 
+# Reasons to send a request again, and whether they mean the host wants
+# us to slow down
+RETRY_REASONS = {
+    'maxlag': True,
+    'ratelimited': True,
+    'unavailable': True,
+    'badtoken': False,
+    'mwoauth-invalid-authorization': False,
+    'invalid-response': False,
+}
+
+def get_retry_reason(r):
+    if r.status_code == 429:
+        return 'ratelimited'
+    if r.status_code == 503:
+        return 'unavailable'
+    try:
+        error = r.json().get('error')
+    except ValueError:
+        return 'invalid-response'
+    if type(error) == dict and error.get('code') in RETRY_REASONS:
+        return error.get('code')
+    return None
+
 def mw_request(data, url=None, user=None, files={}, skipAuth=False, noIgnoreError=False):
     if url is None:
         api_url = mwoauth.api_url + "/api.php"
     else:
         api_url = url
     data['format'] = 'json'
+    if app.config.get('API_MAXLAG', 5):
+        # let lagged wikis ask us to wait instead of adding to their load
+        data.setdefault('maxlag', app.config.get('API_MAXLAG', 5))
+    host = urlparse(api_url).netloc
+    auth = None
     if not skipAuth:
         if user is None:
             access_token = session.get('mwoauth_access_token', {})
@@ -344,33 +947,74 @@ def mw_request(data, url=None, user=None, files={}, skipAuth=False, noIgnoreErro
         else:
             request_token_secret = user.token_secret
             request_token_key = user.token_key
-        auth = OAuth1(app.config.get('CONSUMER_KEY'), app.config.get('CONSUMER_SECRET'), request_token_key, request_token_secret)
-        r = requests.post(api_url, data=data, files=files, auth=auth, headers={'User-Agent': useragent})
-    else:
-        r = requests.post(api_url, data=data, files=files, headers={'User-Agent': useragent})
-    if noIgnoreError:
-        return r
+        auth = client.signer(app.config.get('CONSUMER_KEY'), app.config.get('CONSUMER_SECRET'), request_token_key, request_token_secret)
 
-    try:
-        tmp = r.json()
-        error_code_raw = tmp.get('error')
-        if error_code is not None:
-            print(error_code_raw)
-            if type(error_code_raw) == dict and error_code_raw.get('code') == 'mwoauth-invalid-authorization':
-                return mw_request(data, url, user, files, skipAuth, True)
-    except:
-        print('Retrying request')
-        return mw_request(data, url, user, files, skipAuth, True)
-    
+    throttle = client.throttle(api_url)
+    max_retries = app.config.get('API_MAX_RETRIES', 5)
+    token_refreshed = False
+    for attempt in range(max_retries + 1):
+        kwargs = {'data': data, 'auth': auth}
+        if files:
+            if attempt:
+                for file_data in files.values():
+                    file_data[1].seek(0)
+            # stream uploads instead of letting requests read them into memory
+            body = MultipartBody(data, files)
+            kwargs = {'data': body, 'headers': {'Content-Type': body.content_type}, 'auth': auth}
+            UPLOADED_BYTES.labels(host).inc(len(body))
+        try:
+            with client.limit(api_url), throttle, track_request(host, data.get('action', '')):
+                r = client.post(api_url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            API_RETRIES.labels(host, 'connection-error').inc()
+            time.sleep(backoff_delay(attempt, app.config.get('API_BACKOFF_BASE', 1), app.config.get('API_BACKOFF_MAX', 60)))
+            continue
+        if noIgnoreError:
+            return r
+
+        reason = get_retry_reason(r)
+        if reason == 'badtoken' and ('token' not in data or skipAuth or token_refreshed):
+            reason = None
+        if reason is None:
+            throttle.success()
+            return r
+        if attempt == max_retries:
+            print('Giving up on %s after %d retries (%s)' % (host, attempt, reason))
+            return r
+
+        API_RETRIES.labels(host, reason).inc()
+        if reason == 'badtoken':
+            # cached token expired, get a fresh one and try once more
+            data['token'] = get_token('csrf', url, user, True)
+            token_refreshed = True
+            continue
+        delay = get_retry_after(r)
+        if delay is None:
+            delay = backoff_delay(attempt, app.config.get('API_BACKOFF_BASE', 1), app.config.get('API_BACKOFF_MAX', 60))
+        if RETRY_REASONS[reason]:
+            print('%s asked us to slow down (%s), waiting %.1f seconds' % (host, reason, delay))
+            throttle.throttled(delay)
+        else:
+            time.sleep(delay)
     return r
 
-def get_token(type, url=None, user=None):
+def get_token(type, url=None, user=None, refresh=False):
+    # Tokens of task users are cached until the API rejects them, tokens
+    # of web users are always fetched
+    key = (type, url, user.id) if user is not None else None
+    if key is not None and not refresh and key in token_cache:
+        return token_cache[key]
     data = mw_request({
         'action': 'query',
         'meta': 'tokens',
         'type': type
     }, url, user).json()
-    return data.get('query', {}).get('tokens', {}).get('%stoken' % type)
+    token = data.get('query', {}).get('tokens', {}).get('%stoken' % type)
+    if key is not None:
+        token_cache[key] = token
+    return token
 
 @app.context_processor
 def inject_base_variables():
@@ -379,15 +1023,55 @@ def inject_base_variables():
         "username": mwoauth.get_current_user(),
     }
 
+def is_public_path():
+    return request.endpoint == 'static' or request.path in PUBLIC_PATHS
+
+def get_global_groups(username):
+    # Groups are kept in the (signed) session for PRIVILEGES_CACHE_TTL
+    # seconds, if Meta does not answer in time the last known ones are used
+    cached = session.get('global_groups')
+    if cached is not None and cached.get('username') != username:
+        cached = None
+    if cached is not None and time.time() - cached['checked'] < app.config.get('PRIVILEGES_CACHE_TTL', 300):
+        return cached['groups']
+
+    access_token = session.get('mwoauth_access_token', {})
+    try:
+        r = client.post(mwoauth.api_url, data={
+            "action": "query",
+            "format": "json",
+            "meta": "globaluserinfo",
+            "guiprop": "groups"
+        }, auth=client.signer(
+            app.config.get('CONSUMER_KEY'),
+            app.config.get('CONSUMER_SECRET'),
+            access_token.get('key').decode('utf-8'),
+            access_token.get('secret').decode('utf-8')
+        ), timeout=app.config.get('PRIVILEGES_TIMEOUT', 5))
+        groups = r.json().get('query', {}).get('globaluserinfo', {}).get('groups', [])
+    except (requests.RequestException, ValueError):
+        if cached is None:
+            raise
+        print('Checking groups of %s failed, using cached groups' % username)
+        return cached['groups']
+    session['global_groups'] = {
+        'username': username,
+        'groups': groups,
+        'checked': time.time(),
+    }
+    return groups
+
 @app.before_request
 def ensure_login():
-    if request.path != '/login' and request.path != '/oauth-callback':
+    if request.path != '/login' and request.path != '/oauth-callback' and not is_public_path():
         if not logged():
             return render_template('login.html')
 
 @app.before_request
 def db_init_user():
-    if logged():
+    if request.endpoint in NO_DB_ENDPOINTS:
+        return
+    if logged() and not is_public_path():
         user = get_user()
         access_token = session.get('mwoauth_access_token', {})
         request_token_secret = access_token.get('secret').decode('utf-8')
@@ -396,31 +1080,29 @@ def db_init_user():
             user = User(
                 username=mwoauth.get_current_user(),
                 token_key=request_token_key,
-                token_secret=request_token_key,
+                token_secret=request_token_secret,
             )
             db.session.add(user)
             db.session.commit()
         else:
-            user.token_key = request_token_key
-            user.token_secret = request_token_secret
             if not user.is_active:
                 return render_template('permission_denied.html'), 403
-            
-            db.session.commit()
+
+            # only write the row after a new login
+            if user.token_key != request_token_key or user.token_secret != request_token_secret:
+                user.token_key = request_token_key
+                user.token_secret = request_token_secret
+                db.session.commit()
 
 @app.before_request
 def ensure_privileges():
     if request.path == '/login' or request.path == '/oauth-callback' or request.path == '/logout':
         return
+    if is_public_path():
+        return
 
     if logged():
-        data = mwoauth.request({
-            "action": "query",
-            "format": "json",
-            "meta": "globaluserinfo",
-            "guiprop": "groups"
-        })
-        groups = data.get('query', {}).get('globaluserinfo', {}).get('groups')
+        groups = get_global_groups(mwoauth.get_current_user())
         for group in ALLOWED_GROUPS:
             if group in groups:
                 return
@@ -448,41 +1130,259 @@ def wiki_action(dbname):
     wiki = Wiki.query.filter_by(dbname=dbname)[0]
     return render_template('wiki.html', wiki=wiki)
 
-@celery.task(name='wiki_import_all')
-def task_wiki_import_all(dbname, user_id):
+# Namespaces imported by task_wiki_import_all, every phase starts only after
+# the previous one finished
+IMPORT_PHASES = (
+    # modules and templates, if any
+    (10, 11, 14, 15, 828, 829),
+    # main namespace
+    (NS_MAIN,),
+    # other important namespaces
+    (1,),
+)
+
+def get_next_checkpoint(wiki, cont):
+    # Position after the allpages batch that ended with the continue
+    # parameters cont
+    checkpoint = {
+        'phase': wiki.import_phase or 0,
+        'namespace': wiki.import_namespace,
+        'continue': cont,
+    }
+    if cont is not None:
+        return checkpoint
+    namespaces = IMPORT_PHASES[checkpoint['phase']]
+    i = namespaces.index(checkpoint['namespace']) + 1
+    if i < len(namespaces):
+        checkpoint['namespace'] = namespaces[i]
+    else:
+        checkpoint['phase'] += 1
+        checkpoint['namespace'] = None
+    return checkpoint
+
+def save_checkpoint(wiki, checkpoint, last_title):
+    wiki.import_phase = checkpoint['phase']
+    wiki.import_namespace = checkpoint['namespace']
+    wiki.import_continue = json.dumps(checkpoint['continue']) if checkpoint['continue'] else None
+    if last_title is not None:
+        wiki.import_last_title = last_title
+    db.session.commit()
+
+@celery.task(name='wiki_import_pages', acks_late=True, bind=True, max_retries=None)
+def task_wiki_import_pages(self, dbname, user_id, pages, reconcile=False):
+    token = scheduler.try_acquire(dbname)
+    if token is None:
+        # other wikis are using the slots, queue the chunk again. The run
+        # is alive while it waits, keep it from being taken over as stale.
+        ImportProgress(redis_client, dbname).update({})
+        raise self.retry(countdown=app.config.get('SCHEDULER_RETRY_DELAY', 10))
     wiki = Wiki.query.filter_by(dbname=dbname).first()
     user = User.query.filter_by(id=user_id).first()
+    try:
+        wiki.import_pages(pages, user, reconcile)
+    except Exception:
+        # do not block the following pages because of one chunk
+        print('Failed to import a chunk of %d pages to %s' % (len(pages), dbname))
+        traceback.print_exc()
+    finally:
+        scheduler.release(dbname, token)
+    print('HTTP connection stats: %s' % json.dumps(client.stats()))
+    print('Export cache stats: %s' % json.dumps(wiki.export_cache.stats()))
+    if app.config.get('METRICS_FILE'):
+        write_metrics_file(app.config.get('METRICS_FILE'))
 
-    # import modules and templates, if any
-    for namespace in (10, 11, 14, 15, 828, 829):
-        wiki.import_pages(
-            wiki.get_pages(namespace, user),
-            user
-        )
+@celery.task(name='wiki_import_checkpoint')
+def task_wiki_import_checkpoint(dbname, user_id, checkpoint, last_title, reconcile=False):
+    wiki = Wiki.query.filter_by(dbname=dbname).first()
+    save_checkpoint(wiki, checkpoint, last_title)
+    task_wiki_import_step(dbname, user_id, reconcile)
 
-    # import main namespace
-    wiki.import_pages(
-        wiki.get_noncolon_pages(NS_MAIN, user),
-        user
-    )
+@celery.task(name='wiki_import_step')
+def task_wiki_import_step(dbname, user_id, reconcile=False):
+    try:
+        import_step(dbname, user_id, reconcile)
+    except Exception:
+        # keep the checkpoint, so the next run resumes from it
+        db.session.rollback()
+        stop_import(Wiki.query.filter_by(dbname=dbname).first(), 'failed')
+        raise
+
+def import_step(dbname, user_id, reconcile=False):
+    # Import the next allpages batch from the saved checkpoint. Its pages
+    # are split into chunks that run in parallel, the checkpoint only moves
+    # past the batch once all of them finished.
+    wiki = Wiki.query.filter_by(dbname=dbname).first()
+    user = User.query.filter_by(id=user_id).first()
+    chunk_size = app.config.get('IMPORT_CHUNK_SIZE', 100)
+
+    while (wiki.import_phase or 0) < len(IMPORT_PHASES):
+        if wiki.import_namespace is None:
+            wiki.import_namespace = IMPORT_PHASES[wiki.import_phase or 0][0]
+        cont = json.loads(wiki.import_continue) if wiki.import_continue else None
+        pages, cont = wiki.get_pages_batch(wiki.import_namespace, user, cont)
+        checkpoint = get_next_checkpoint(wiki, cont)
+        last_title = pages[-1] if pages else None
+
+        if wiki.import_namespace == NS_MAIN:
+            pages = wiki.get_noncolon_pages(pages)
+        planned = len(pages)
+        if not reconcile:
+            imported = wiki.get_imported_pages(pages)
+            pages = [page for page in pages if page not in imported]
+        position = json.dumps([wiki.import_phase or 0, wiki.import_namespace, wiki.import_continue])
+        wiki.progress.add_batch(position, planned=planned, skipped=planned - len(pages))
+        wiki.progress.set_namespace(wiki.import_namespace)
+        if not pages:
+            save_checkpoint(wiki, checkpoint, last_title)
+            continue
+
+        chord([
+            task_wiki_import_pages.si(dbname, user_id, pages[i:i + chunk_size], reconcile)
+            for i in range(0, len(pages), chunk_size)
+        ])(task_wiki_import_checkpoint.si(dbname, user_id, checkpoint, last_title, reconcile).on_error(
+            task_wiki_import_failed.si(dbname)
+        ))
+        return
+
+    print('Import of %s finished' % dbname)
+    # start from the beginning next time
+    reset_checkpoint(wiki)
+    stop_import(wiki, 'finished')
+
+@celery.task(name='wiki_import_failed')
+def task_wiki_import_failed(dbname):
+    # a chunk of the chord failed, so the checkpoint task never runs
+    print('Import of %s failed' % dbname)
+    stop_import(Wiki.query.filter_by(dbname=dbname).first(), 'failed')
+
+def stop_import(wiki, state):
+    wiki.progress.set_state(state)
+    scheduler.deactivate(wiki.dbname)
+    wiki.import_started = False
+    db.session.commit()
 
-    # import other important namespaces
-    for namespace in (1,):
-        wiki.import_pages(
-            wiki.get_pages(namespace, user),
-            user
+def reset_checkpoint(wiki):
+    wiki.import_phase = 0
+    wiki.import_namespace = None
+    wiki.import_continue = None
+    wiki.import_last_title = None
+
+def start_import(dbname, reconcile=False):
+    # Claim the wiki for a new or resumed run, returns False if another run
+    # is active. Counters of an unfinished run are kept when it is resumed.
+    wiki = Wiki.query.filter_by(dbname=dbname).first()
+    if wiki.import_started:
+        # the previous run is taken over only once it went stale
+        if not wiki.progress.take_over(app.config.get('IMPORT_STALE_SECONDS', 3600)):
+            print('%s is being imported already, not starting another run' % dbname)
+            return False
+    else:
+        claimed = Wiki.query.filter_by(id=wiki.id, import_started=False).update(
+            {'import_started': True},
+            synchronize_session=False
         )
+        db.session.commit()
+        if not claimed:
+            return False
+        db.session.refresh(wiki)
+
+    if reconcile:
+        # a sync always walks the whole wiki, not the rest of an import
+        reset_checkpoint(wiki)
+        db.session.commit()
+    if not wiki.import_phase and wiki.import_namespace is None:
+        wiki.progress.start()
+    else:
+        wiki.progress.set_state('running')
+    scheduler.activate(dbname, wiki.import_priority or 1)
+    return True
+
+@celery.task(name='wiki_import_all')
+def task_wiki_import_all(dbname, user_id):
+    # resumes from the saved checkpoint, if the previous run did not finish
+    if start_import(dbname):
+        task_wiki_import_step(dbname, user_id)
 
 @app.route('/wiki/<path:dbname>/import', methods=['POST'])
 def wiki_import(dbname):
     wiki = Wiki.query.filter_by(dbname=dbname).first()
     user = get_user()
+    if wiki.is_import_running():
+        flash(_('wiki-import-running'))
+        return redirect(url_for('wiki_action', dbname=dbname))
+    if request.form.get('priority'):
+        try:
+            priority = int(request.form.get('priority'))
+        except ValueError:
+            flash(_('priority-invalid'), 'error')
+            return redirect(url_for('wiki_action', dbname=dbname))
+        wiki.import_priority = max(1, priority)
+        db.session.commit()
 
     task_wiki_import_all.delay(dbname, user.id)
 
     flash(_('wiki-imported'))
     return redirect(url_for('wiki_action', dbname=dbname))
 
+@celery.task(name='wiki_sync_all')
+def task_wiki_sync_all(dbname, user_id):
+    # like task_wiki_import_all, but re-imports pages changed on Incubator
+    if start_import(dbname, True):
+        task_wiki_import_step(dbname, user_id, True)
+
+@app.route('/wiki/<path:dbname>/sync', methods=['POST'])
+def wiki_sync(dbname):
+    wiki = Wiki.query.filter_by(dbname=dbname).first()
+    user = get_user()
+    if wiki.is_import_running():
+        flash(_('wiki-import-running'))
+        return redirect(url_for('wiki_action', dbname=dbname))
+
+    task_wiki_sync_all.delay(dbname, user.id)
+
+    flash(_('wiki-sync-started'))
+    return redirect(url_for('wiki_action', dbname=dbname))
+
+def get_dump_path(name):
+    # Dumps can only be read from DUMP_DIR, returns None for other paths
+    dump_dir = app.config.get('DUMP_DIR')
+    if not dump_dir or not name:
+        return None
+    dump_dir = os.path.realpath(dump_dir)
+    path = os.path.realpath(os.path.join(dump_dir, name))
+    if os.path.commonpath([dump_dir, path]) != dump_dir or not os.path.isfile(path):
+        return None
+    return path
+
+@celery.task(name='wiki_stage_dump')
+def task_wiki_stage_dump(dbname, dump_path):
+    dump_path = get_dump_path(dump_path)
+    if dump_path is None:
+        print('Refusing to stage a dump from outside of DUMP_DIR')
+        return
+    wiki = Wiki.query.filter_by(dbname=dbname).first()
+    namespaces = set(namespace for phase in IMPORT_PHASES for namespace in phase)
+    paths = wiki.stage_dump(dump_path, namespaces)
+    print('Staged %d pages of %s from %s' % (len(paths), dbname, dump_path))
+
+@app.route('/wiki/<path:dbname>/progress.json')
+def wiki_progress(dbname):
+    return jsonify(ImportProgress(redis_client, dbname).get(app.config.get('IMPORT_STALE_SECONDS', 3600)))
+
+@app.route('/wiki/<path:dbname>/stage-dump', methods=['POST'])
+def wiki_stage_dump(dbname):
+    if get_dump_path(request.form.get('dump_path')) is None:
+        flash(_('dump-path-invalid'), 'error')
+        return redirect(url_for('wiki_action', dbname=dbname))
+    task_wiki_stage_dump.delay(dbname, request.form.get('dump_path'))
+
+    flash(_('wiki-dump-staging'))
+    return redirect(url_for('wiki_action', dbname=dbname))
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
 @app.route('/test.json')
 def test():
     return jsonify(mw_request({
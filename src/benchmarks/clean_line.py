@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Micro-benchmark of WikiCleaner.clean_line against the previous
+# implementation, which recompiled every regex on every line.
+#
+# Usage: python benchmarks/clean_line.py [repeat]
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cleaner import WikiCleaner  # noqa: E402
+
+NAMESPACES = {
+    "Talk": "Diskuse",
+    "User": "Uživatel",
+    "User talk": "Diskuse s uživatelem",
+    "Project": "Wikipedie",
+    "Project talk": "Diskuse k Wikipedii",
+    "File": "Soubor",
+    "File talk": "Diskuse k souboru",
+    "MediaWiki": "MediaWiki",
+    "MediaWiki talk": "Diskuse k MediaWiki",
+    "Template": "Šablona",
+    "Template talk": "Diskuse k šabloně",
+    "Help": "Nápověda",
+    "Help talk": "Diskuse k nápovědě",
+    "Category": "Kategorie",
+    "Category talk": "Diskuse ke kategorii",
+    "Module": "Modul",
+    "Module talk": "Diskuse k modulu",
+    "Image": "Soubor",
+}
+
+LINES = [
+    '  <page>\n',
+    '    <title>Wp/xyz/Hlavní strana</title>\n',
+    '      <contributor>\n',
+    '        <username>Example</username>\n',
+    '      <timestamp>2020-01-01T00:00:00Z</timestamp>\n',
+    "'''Hlavní strana''' je [[Wp/xyz/Stránka|stránka]] v [[wp/xyz/Jazyk|jazyku]]ch.\n",
+    '{{Wp/xyz/Infobox|název=[[Wp/xyz/Abc|abc]]def}}\n',
+    '[[Template:Wp/xyz/Foo]] a [[ user : Example|Example]] [[File:Foo.png|thumb]]\n',
+    '[[Category:Wp/xyz]]\n',
+    '[[Category:Wp/xyz/Lidé|{{PAGENAME}}]]\n',
+    '[[Category:Maintenance|X]]\n',
+    '[[Category:Test|[[Category:Nested]]]]\n',
+    'Plain text without any links at all, which is what most lines are.\n',
+]
+
+
+def legacy_clean_line(line, prefix, is_wiktionary, namespaces):
+    prefix = "[" + prefix[0].upper() + prefix[0].lower() + "]" + prefix[1:]
+    line = re.sub(r" *(?i:" + prefix + r")/", "", line)
+    if not is_wiktionary:
+        line = re.sub(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)\ *\]\]", r"[[\3]]", line)
+        line = re.sub(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)(\w+) *\]\]", r"[[\3]]\4", line)
+    else:
+        line = re.sub(r"\[\[ *(.*?) *\| *\1 *\]\]", r"[[\1]]", line)
+        line = re.sub(r"\[\[ *(.*?) *\| *\1(\w+) *\]\]", r"[[\1]]\2", line)
+    line = re.sub(r"\[\[ *[Cc]ategory *: *" + prefix + r".*?\]\]\n?", "", line)
+    line = re.sub(r"\[\[ *[Cc]ategory *: *(.+?)\|{{(SUB)?PAGENAME}} *\]\]", r"[[Category:\1]]", line)
+    line = re.sub(r"\[\[ *[Cc]ategory *: *(.+?)\|\w *\]\]", r"[[Category:\1]]", line)
+    for key in namespaces:
+        key_regex = r"[" + key[0].upper() + key[0].lower() + r"]" + key[1:]
+        line = re.sub(r"\[\[ *" + key_regex + r" *: *([^\|\]])", r"[[" + namespaces[key] + r":\1", line)
+    return line
+
+
+def run(func, lines, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for line in lines:
+            func(line)
+    return time.perf_counter() - start
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    prefix = 'Wp/xyz'
+    for is_wiktionary in (False, True):
+        cleaner = WikiCleaner(prefix, is_wiktionary, NAMESPACES)
+        for line in LINES:
+            expected = legacy_clean_line(line, prefix, is_wiktionary, NAMESPACES)
+            if cleaner.clean_line(line) != expected:
+                sys.exit('Output mismatch for %r' % line)
+
+        legacy = run(lambda line: legacy_clean_line(line, prefix, is_wiktionary, NAMESPACES), LINES, repeat)
+        compiled = run(cleaner.clean_line, LINES, repeat)
+        print('is_wiktionary=%s lines=%d legacy=%.3fs compiled=%.3fs speedup=%.1fx' % (
+            is_wiktionary,
+            len(LINES) * repeat,
+            legacy,
+            compiled,
+            legacy / compiled
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of the export cleaning hot path over the corpus in
+# benchmarks/corpus. Every case in cases.json is cleaned line by line with
+# WikiCleaner.clean_line and as a stream with ExportTransformer, the output
+# must be byte-identical to the checked in <name>.lines.golden and
+# <name>.xml.golden files.
+#
+# Usage: python benchmarks/cleaning.py [--repeat N] [--update]
+#
+# --update rewrites the golden files, only use it for intended changes of
+# the cleaning rules and review the diff.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cleaner import ExportTransformer, WikiCleaner  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+
+
+def clean_lines(cleaner, data):
+    return ''.join(
+        cleaner.clean_line(line)
+        for line in data.decode('utf-8').splitlines(True)
+    )
+
+
+def clean_stream(cleaner, data):
+    chunks = [data[i:i + 65536] for i in range(0, len(data), 65536)]
+    return ''.join(
+        event[1]
+        for event in ExportTransformer(cleaner).transform(chunks)
+        if event[0] == 'text'
+    )
+
+
+def measure(func, cleaner, data, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        output = func(cleaner, data)
+    return output, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--update', action='store_true')
+    args = parser.parse_args()
+
+    with open(os.path.join(CORPUS_DIR, 'cases.json')) as f:
+        cases = json.load(f)
+
+    failed = False
+    for case in cases:
+        with open(os.path.join(CORPUS_DIR, case['input']), 'rb') as f:
+            data = f.read()
+        lines = data.count(b'\n') * args.repeat
+        megabytes = len(data) * args.repeat / 1024 / 1024
+        cleaner = WikiCleaner(case['prefix'], case['is_wiktionary'], case['namespaces'])
+        for mode, func in (('lines', clean_lines), ('xml', clean_stream)):
+            output, elapsed = measure(func, cleaner, data, args.repeat)
+            golden_path = os.path.join(CORPUS_DIR, '%s.%s.golden' % (case['name'], mode))
+            if args.update:
+                with open(golden_path, 'wb') as f:
+                    f.write(output.encode('utf-8'))
+                status = 'updated'
+            else:
+                with open(golden_path, 'rb') as f:
+                    status = 'ok' if f.read() == output.encode('utf-8') else 'MISMATCH'
+            failed = failed or status == 'MISMATCH'
+            print('%-28s %-5s %8s %12.0f lines/s %8.2f MB/s' % (
+                case['name'],
+                mode,
+                status,
+                lines / elapsed,
+                megabytes / elapsed
+            ))
+    if failed:
+        sys.exit('Cleaning output differs from the golden files')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+
+class ExportCache:
+    """Cleaned exports on disk, keyed by page title and latest revision id.
+
+    The directory is kept under max_bytes by removing the least recently
+    used files. Files handed out by get() or registered by add() stay pinned
+    until release() so they are not evicted before they are imported. Pins
+    are per process, files used by other processes are protected by a lease:
+    a file is not evicted for lease seconds after it was written or touched.
+    """
+
+    def __init__(self, directory, max_bytes, suffix='.xml', lease=600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.lease = lease
+        self.name_re = re.compile(r'^[0-9a-f]{32}(-\d+)?%s$' % re.escape(suffix))
+        self.lock = threading.Lock()
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = None
+        # nothing on disk can be evicted before this time
+        self.next_evict = 0
+
+    def path(self, page_title, revid=None):
+        name = hashlib.md5(page_title.encode('utf-8')).hexdigest()
+        if revid is not None:
+            name = '%s-%s' % (name, revid)
+        return os.path.join(self.directory, name + self.suffix)
+
+    def get(self, page_title, revid):
+        if revid is None:
+            return None
+        path = self.path(page_title, revid)
+        with self.lock:
+            if not os.path.exists(path):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.pinned.add(path)
+        self.touch(path)
+        return path
+
+    def touch(self, path):
+        # mark as recently used, which renews the lease of the file
+        os.utime(path)
+
+    def add(self, path):
+        with self.lock:
+            self.pinned.add(path)
+            if self.size is None:
+                self.size = self.scan_size()
+            else:
+                self.size += os.path.getsize(path)
+            if self.size > self.max_bytes and time.time() >= self.next_evict:
+                self.evict()
+
+    def release(self, path):
+        with self.lock:
+            self.pinned.discard(path)
+            self.next_evict = 0
+
+    def scan(self):
+        # only cache entries, not temporary files or other data
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and self.name_re.match(entry.name):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def scan_size(self):
+        return sum(size for mtime, size, path in self.scan())
+
+    def evict(self):
+        # Other processes write to the same directory, so look at what is
+        # actually on disk rather than what this process added
+        entries = sorted(self.scan())
+        self.size = sum(size for mtime, size, path in entries)
+        now = time.time()
+        next_evict = float('inf')
+        for mtime, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            if path in self.pinned:
+                continue
+            if now - mtime < self.lease:
+                next_evict = min(next_evict, mtime + self.lease)
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+        # do not scan again on every add() while nothing can be evicted,
+        # only once a lease expired or a pin was released
+        self.next_evict = next_evict if self.size > self.max_bytes else 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': self.size,
+        }
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from collections import deque
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+
+def first_letter_regex(text):
+    return "[" + text[0].upper() + text[0].lower() + "]" + text[1:]
+
+
+# WikiCleaner instances of a process pool worker, by WikiCleaner.config
+cleaners = {}
+
+
+def clean_texts(config, texts):
+    # Runs in a process pool worker, where the cleaner is built only once
+    cleaner = cleaners.get(config)
+    if cleaner is None:
+        prefix, is_wiktionary, namespaces = config
+        cleaner = cleaners[config] = WikiCleaner(prefix, is_wiktionary, dict(namespaces))
+    return [cleaner.clean_text(text) for text in texts]
+
+
+class WikiCleaner:
+    """Compiled set of the rules used to clean up Incubator exports.
+
+    Built once per wiki (prefix, case mode and namespace map) and reused for
+    every line of every page imported by a task.
+    """
+
+    def __init__(self, prefix, is_wiktionary=False, namespaces=None):
+        self.prefix = prefix
+        self.is_wiktionary = is_wiktionary
+        self.namespaces = namespaces or {}
+
+        prefix_regex = first_letter_regex(prefix)
+        self.prefix_re = re.compile(r" *(?i:" + prefix_regex + r")/")
+        if not is_wiktionary:
+            # [[Abc|abc]] -> [[abc]] and [[Abc|abcdef]] -> [[abc]]def
+            self.link_res = [
+                (re.compile(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)\ *\]\]"), r"[[\3]]"),
+                (re.compile(r"\[\[ *((?i:\w))(.*?) *\| *((?i:\1)\2)(\w+) *\]\]"), r"[[\3]]\4"),
+            ]
+        else:
+            # [[abc|abc]] -> [[abc]] and [[abc|abcdef]] -> [[abc]]def
+            self.link_res = [
+                (re.compile(r"\[\[ *(.*?) *\| *\1 *\]\]"), r"[[\1]]"),
+                (re.compile(r"\[\[ *(.*?) *\| *\1(\w+) *\]\]"), r"[[\1]]\2"),
+            ]
+        self.category_res = [
+            # Remove the base category
+            (re.compile(r"\[\[ *[Cc]ategory *: *" + prefix_regex + r".*?\]\]\n?"), ""),
+            # Remove {{PAGENAME}} category sortkeys, and one-letter-only sortkeys
+            (re.compile(r"\[\[ *[Cc]ategory *: *(.+?)\|{{(SUB)?PAGENAME}} *\]\]"), r"[[Category:\1]]"),
+            (re.compile(r"\[\[ *[Cc]ategory *: *(.+?)\|\w *\]\]"), r"[[Category:\1]]"),
+        ]
+
+        # One pattern per namespace, in the order they are applied one after
+        # another by the sequential fallback
+        self.namespace_res = []
+        for key in self.namespaces:
+            self.namespace_res.append((
+                re.compile(r"\[\[ *" + first_letter_regex(key) + r" *: *([^\|\]])"),
+                r"[[" + self.namespaces[key] + r":\1"
+            ))
+
+        # All namespaces merged into one alternation. Translating a namespace
+        # can produce a name that a later namespace rule translates again, so
+        # resolve those chains here to get what the sequential passes produce.
+        self.namespace_map = {}
+        for i, key in enumerate(self.namespaces):
+            value = self.namespaces[key]
+            for pattern, replacement in self.namespace_res[i + 1:]:
+                if pattern.match("[[%s:x" % value):
+                    value = pattern.sub(replacement, "[[%s:x" % value)[2:-2]
+            self.namespace_map[key[0].lower() + key[1:]] = value
+        if self.namespaces:
+            self.namespace_re = re.compile(r"\[\[ *(%s) *: *([^\|\]])" % "|".join(
+                "(?:%s)" % first_letter_regex(key) for key in self.namespaces
+            ))
+        else:
+            self.namespace_re = None
+        # A namespace link whose first character opens another link: the
+        # sequential passes can each consume that bracket differently
+        self.nested_link_re = re.compile(r": *\[")
+
+    def translate_namespace(self, match):
+        key = match.group(1)
+        return "[[" + self.namespace_map[key[0].lower() + key[1:]] + ":" + match.group(2)
+
+    @property
+    def config(self):
+        return (self.prefix, self.is_wiktionary, tuple(self.namespaces.items()))
+
+    def clean_title(self, title):
+        return self.prefix_re.sub("", title)
+
+    def clean_text(self, text):
+        # the rules are line-based, but none of them matches across lines
+        return self.clean_line(text)
+
+    def clean_line(self, line):
+        line = self.prefix_re.sub("", line)
+        if "[[" not in line:
+            return line
+        for pattern, replacement in self.link_res:
+            line = pattern.sub(replacement, line)
+        for pattern, replacement in self.category_res:
+            line = pattern.sub(replacement, line)
+        if self.namespace_re is None:
+            return line
+        if self.nested_link_re.search(line):
+            for pattern, replacement in self.namespace_res:
+                line = pattern.sub(replacement, line)
+            return line
+        return self.namespace_re.sub(self.translate_namespace, line)
+
+
+class ExportTransformer:
+    """Streaming cleaner of Special:Export XML that follows its structure.
+
+    Page titles and redirect targets get the title rules and revision
+    <text> the wikitext rules, everything else is copied as is. transform()
+    takes the export as byte chunks and yields events:
+
+        ('text', str)               cleaned XML to write out
+        ('page_start',)             before the XML of a <page>
+        ('page_info', title, ns)    original title and namespace of the page
+        ('revision', revid)         id of a revision of the page
+        ('page_end',)               after the XML of a </page>
+
+    Only the text of a single element is held in memory at a time.
+
+    wanted(title, ns) can filter the pages. The rest of a page it rejects
+    is neither captured nor cleaned, only its page_info and page_end events
+    are yielded.
+
+    With a process pool (a multiprocessing or billiard Pool), revision
+    texts are sent to it in batches of about
+    chunk_bytes and cleaned in parallel while parsing continues, up to
+    max_pending_bytes ahead of the output. Events still come out in order
+    and with the same content as without a pool.
+    """
+
+    CAPTURED = ('title', 'text', 'ns', 'id')
+
+    def __init__(self, cleaner, pool=None, chunk_bytes=1024 * 1024, max_pending_bytes=16 * 1024 * 1024):
+        self.cleaner = cleaner
+        self.pool = pool
+        self.chunk_bytes = chunk_bytes
+        self.max_pending_bytes = max_pending_bytes
+
+    def transform(self, chunks, wanted=None):
+        self.wanted = wanted
+        self.skipping = False
+        self.events = []
+        self.queue = deque()
+        self.batch = None
+        self.pending_bytes = 0
+        self.out = []
+        self.pending_start = False
+        self.capture = None
+        self.buffer = []
+        self.in_page = False
+        self.in_revision = False
+        self.page_title = None
+
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.ordered_attributes = True
+        parser.XmlDeclHandler = self.xml_decl
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.chars
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+            self.flush()
+            self.queue.extend(self.events)
+            self.events = []
+            while self.queue and (self.is_ready(self.queue[0]) or self.pending_bytes > self.max_pending_bytes):
+                yield self.resolve(self.queue.popleft())
+        parser.Parse(b'', True)
+        self.flush()
+        self.queue.extend(self.events)
+        self.events = []
+        while self.queue:
+            yield self.resolve(self.queue.popleft())
+
+    def flush(self):
+        if self.out:
+            self.events.append(('text', ''.join(self.out)))
+            self.out = []
+
+    def defer_text(self, text):
+        # Queue the text of a <text> element, whose start tag is still open,
+        # for cleaning in the pool
+        if self.batch is None:
+            self.batch = {'texts': [], 'bytes': 0, 'result': None}
+        batch = self.batch
+        batch['texts'].append(text)
+        batch['bytes'] += len(text)
+        self.pending_bytes += len(text)
+        self.flush()
+        self.events.append(('deferred', batch, len(batch['texts']) - 1))
+        if batch['bytes'] >= self.chunk_bytes:
+            self.submit()
+
+    def submit(self):
+        if self.batch is not None:
+            self.batch['result'] = self.pool.apply_async(clean_texts, (self.cleaner.config, self.batch['texts']))
+            self.batch = None
+
+    def is_ready(self, event):
+        if event[0] != 'deferred':
+            return True
+        result = event[1]['result']
+        return result is not None and result.ready()
+
+    def resolve(self, event):
+        if event[0] != 'deferred':
+            return event
+        batch, i = event[1], event[2]
+        if batch['result'] is None:
+            self.submit()
+        text = batch['result'].get()[i]
+        self.pending_bytes -= len(batch['texts'][i])
+        if text:
+            return ('text', '>' + escape(text) + '</text>')
+        return ('text', ' />')
+
+    def close_start(self):
+        if self.pending_start:
+            self.out.append('>')
+            self.pending_start = False
+
+    def xml_decl(self, version, encoding, standalone):
+        self.out.append('<?xml version="%s" encoding="utf-8"?>\n' % version)
+
+    def start(self, name, attrs):
+        if self.skipping:
+            return
+        self.close_start()
+        if name == 'page':
+            self.flush()
+            self.events.append(('page_start',))
+            self.in_page = True
+            self.page_title = None
+        elif name == 'revision':
+            self.in_revision = True
+        elif name == 'redirect':
+            attrs = list(attrs)
+            for i in range(0, len(attrs), 2):
+                if attrs[i] == 'title':
+                    attrs[i + 1] = self.cleaner.clean_title(attrs[i + 1])
+        if name in self.CAPTURED:
+            self.capture = name
+            self.buffer = []
+        self.out.append('<' + name)
+        for i in range(0, len(attrs), 2):
+            self.out.append(' %s="%s"' % (attrs[i], escape(attrs[i + 1], {'"': '&quot;'})))
+        self.pending_start = True
+
+    def end(self, name):
+        if self.skipping:
+            if name == 'page':
+                self.skipping = False
+                self.in_page = False
+                self.in_revision = False
+                self.events.append(('page_end',))
+            return
+        if self.capture == name:
+            self.capture = None
+            data = ''.join(self.buffer)
+            self.buffer = []
+            if name == 'title' and self.in_page:
+                self.page_title = data
+                data = self.cleaner.clean_title(data)
+            elif name == 'text':
+                if self.pool is not None and data:
+                    self.defer_text(data)
+                    self.pending_start = False
+                    return
+                data = self.cleaner.clean_text(data)
+            elif name == 'ns' and self.in_page:
+                self.flush()
+                self.events.append(('page_info', self.page_title, int(data)))
+                if self.wanted is not None and not self.wanted(self.page_title, int(data)):
+                    # drop the page up to its </page>
+                    self.skipping = True
+                    self.pending_start = False
+                    self.out = []
+                    return
+            elif name == 'id' and self.in_revision:
+                self.in_revision = False
+                self.events.append(('revision', data))
+            if data:
+                self.close_start()
+                self.out.append(escape(data))
+        if self.pending_start:
+            self.out.append(' />')
+            self.pending_start = False
+        else:
+            self.out.append('</%s>' % name)
+        if name == 'page':
+            self.in_page = False
+            self.flush()
+            self.events.append(('page_end',))
+
+    def chars(self, data):
+        if self.skipping:
+            return
+        if self.capture is not None:
+            self.buffer.append(data)
+            return
+        self.close_start()
+        self.out.append(escape(data))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1
+
+
+class HttpClient:
+    """Keep-alive HTTP sessions shared by all API and export requests.
+
+    There is one pooled session per host and one OAuth1 signer per set of
+    credentials, so neither connections nor signers are rebuilt per call.
+    Requests without their own timeout get the (connect, read) timeout.
+    """
+
+    def __init__(self, user_agent, pool_connections=10, pool_maxsize=10, max_per_host=4, timeout=None):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_per_host = max_per_host
+        self.sessions = {}
+        self.signers = {}
+        self.slots = {}
+        self.throttles = {}
+        # host -> limiter shared with other processes, see limit()
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def session(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                session.headers.update({'User-Agent': self.user_agent})
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def slot(self, url):
+        # Semaphore limiting concurrent long-running downloads from a host
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[host]
+
+    def limit(self, url):
+        # Context manager of the limit set for a host in host_limits
+        return self.host_limits.get(urlparse(url).netloc, nullcontext())
+
+    def throttle(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.throttles:
+                self.throttles[host] = HostThrottle(self.max_per_host)
+            return self.throttles[host]
+
+    def signer(self, consumer_key, consumer_secret, token_key, token_secret):
+        key = (consumer_key, token_key, token_secret)
+        with self.lock:
+            if key not in self.signers:
+                self.signers[key] = OAuth1(consumer_key, consumer_secret, token_key, token_secret)
+            return self.signers[key]
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).post(url, **kwargs)
+
+    def stats(self):
+        # Requests sent and connections opened per host, every request above
+        # the number of connections reused an already open connection
+        res = {}
+        with self.lock:
+            sessions = list(self.sessions.items())
+        for host, session in sessions:
+            stats = {'requests': 0, 'connections': 0}
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    stats['requests'] += pool.num_requests
+                    stats['connections'] += pool.num_connections
+            stats['reused'] = stats['requests'] - stats['connections']
+            res[host] = stats
+        return res
+
+
+class HostThrottle:
+    """Adaptive limit of concurrent API requests to one host.
+
+    The limit grows by one after as many successful requests as the
+    current limit and is halved when the host throttles us, which also
+    pauses all requests to the host for the delay it asked for.
+    """
+
+    def __init__(self, max_limit, limit=1):
+        self.max_limit = max_limit
+        self.limit = min(limit, max_limit)
+        self.active = 0
+        self.successes = 0
+        self.paused_until = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    break
+                self.condition.wait(wait if wait > 0 else None)
+            self.active += 1
+        return self
+
+    def __exit__(self, *args):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def throttled(self, delay):
+        with self.condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def backoff_delay(attempt, base=1, cap=60):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def get_retry_after(response):
+    # only the delta-seconds form is used by MediaWiki
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class MultipartBody:
+    """multipart/form-data request body streamed from its parts.
+
+    Files are read in chunks while the request is sent, the total length is
+    known up front from len() of the file objects.
+    """
+
+    def __init__(self, fields, files, chunk_size=65536):
+        self.boundary = uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.parts = []
+        for name, value in fields.items():
+            self.parts.append((
+                '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+                    self.boundary, name, value
+                )
+            ).encode('utf-8'))
+        for name, (filename, fileobj) in files.items():
+            self.parts.append((
+                '--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                'Content-Type: application/xml\r\n\r\n' % (self.boundary, name, filename)
+            ).encode('utf-8'))
+            self.parts.append(fileobj)
+            self.parts.append(b'\r\n')
+        self.parts.append(('--%s--\r\n' % self.boundary).encode('utf-8'))
+        self.current = 0
+        self.buffer = b''
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+        res = []
+        while size > 0 and self.current < len(self.parts):
+            part = self.parts[self.current]
+            if isinstance(part, bytes):
+                if not self.buffer:
+                    self.buffer = part
+                chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+                if not self.buffer:
+                    self.current += 1
+            else:
+                chunk = part.read(min(size, self.chunk_size))
+                if not chunk:
+                    self.current += 1
+                    continue
+            res.append(chunk)
+            size -= len(chunk)
+        return b''.join(res)
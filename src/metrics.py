@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Prometheus metrics of the importer. Celery runs tasks in several
+# processes, set PROMETHEUS_MULTIPROC_DIR to a directory shared by them to
+# get the metrics of all of them from one endpoint or file.
+
+import os
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, \
+    REGISTRY, start_http_server, write_to_textfile
+from prometheus_client import multiprocess
+
+API_REQUESTS = Counter(
+    'wiki_importer_api_requests_total',
+    'MediaWiki API and export requests',
+    ['host', 'action']
+)
+API_REQUEST_SECONDS = Histogram(
+    'wiki_importer_api_request_seconds',
+    'Duration of MediaWiki API and export requests',
+    ['host', 'action'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+API_RETRIES = Counter(
+    'wiki_importer_api_retries_total',
+    'MediaWiki API requests sent again',
+    ['host', 'reason']
+)
+DOWNLOADED_BYTES = Counter(
+    'wiki_importer_downloaded_bytes_total',
+    'Bytes of exports downloaded from Incubator',
+    ['host']
+)
+UPLOADED_BYTES = Counter(
+    'wiki_importer_uploaded_bytes_total',
+    'Bytes of import XML uploaded to target wikis',
+    ['host']
+)
+PAGES = Counter(
+    'wiki_importer_pages_total',
+    'Pages processed by import_pages, by result',
+    ['wiki', 'result']
+)
+QUEUE_DEPTH = Gauge(
+    'wiki_importer_prefetch_queue_depth',
+    'Export batches downloaded or being downloaded ahead of the import',
+    ['wiki'],
+    multiprocess_mode='livesum'
+)
+
+
+def get_registry():
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def start_metrics_server(port):
+    start_http_server(port, registry=get_registry())
+
+
+def write_metrics_file(path):
+    # for the node exporter textfile collector or a pushgateway job
+    write_to_textfile(path, get_registry())
+
+
+def mark_process_dead(pid):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+@contextmanager
+def track_request(host, action):
+    API_REQUESTS.labels(host, action).inc()
+    with API_REQUEST_SECONDS.labels(host, action).time():
+        yield
+
+
+def count_bytes(chunks, counter):
+    for chunk in chunks:
+        counter.inc(len(chunk))
+        yield chunk
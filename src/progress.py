@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from redis.exceptions import WatchError
+
+COUNTERS = ('planned', 'done', 'skipped', 'failed')
+
+
+class ImportProgress:
+    """Progress of the import of one wiki, kept in a Redis hash.
+
+    Tasks of all workers increment the same counters, so reading the
+    progress never needs to query the Page table.
+    """
+
+    def __init__(self, redis, dbname, ttl=7 * 24 * 3600):
+        self.redis = redis
+        self.key = 'wiki_importer:progress:%s' % dbname
+        self.ttl = ttl
+
+    def start(self):
+        now = time.time()
+        with self.redis.pipeline() as pipe:
+            pipe.delete(self.key)
+            pipe.hset(self.key, mapping={
+                'state': 'running',
+                'started': now,
+                'updated': now,
+            })
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+
+    def set_state(self, state):
+        self.update({'state': state})
+
+    def set_namespace(self, namespace):
+        self.update({'namespace': namespace})
+
+    def update(self, mapping):
+        mapping = dict(mapping, updated=time.time())
+        with self.redis.pipeline() as pipe:
+            pipe.hset(self.key, mapping=mapping)
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+
+    def add(self, **counts):
+        counts = {name: value for name, value in counts.items() if value}
+        if not counts:
+            return
+        with self.redis.pipeline() as pipe:
+            for name, value in counts.items():
+                pipe.hincrby(self.key, name, value)
+            pipe.hset(self.key, 'updated', time.time())
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+
+    def add_batch(self, position, **counts):
+        # a batch is enumerated again when an unfinished run is resumed,
+        # count it only once
+        if self.redis.hget(self.key, 'batch') == position.encode('utf-8'):
+            return
+        self.add(**counts)
+        self.update({'batch': position})
+
+    def is_stale(self, seconds):
+        updated = self.redis.hget(self.key, 'updated')
+        return updated is None or time.time() - float(updated) > seconds
+
+    def take_over(self, seconds):
+        # Claim a run whose counters went stale. The hash is watched, so
+        # only one of concurrent callers succeeds.
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(self.key)
+                updated = pipe.hget(self.key, 'updated')
+                if updated is not None and time.time() - float(updated) <= seconds:
+                    return False
+                pipe.multi()
+                pipe.hset(self.key, 'updated', time.time())
+                pipe.expire(self.key, self.ttl)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def get(self, stale_after=None):
+        raw = {
+            key.decode('utf-8'): value.decode('utf-8')
+            for key, value in self.redis.hgetall(self.key).items()
+        }
+        res = {name: int(raw.get(name, 0)) for name in COUNTERS}
+        res['state'] = raw.get('state', 'idle')
+        if res['state'] == 'running' and stale_after is not None and \
+                time.time() - float(raw.get('updated', 0)) > stale_after:
+            # the workers died without finishing the run
+            res['state'] = 'stalled'
+        res['namespace'] = int(raw['namespace']) if 'namespace' in raw else None
+        res['rate'] = None
+        res['eta'] = None
+        if 'started' in raw:
+            # pages per second since the start, pages still to do are only
+            # those enumerated so far
+            end = time.time() if res['state'] == 'running' else float(raw['updated'])
+            elapsed = end - float(raw['started'])
+            processed = res['done'] + res['skipped'] + res['failed']
+            if elapsed > 0 and processed:
+                res['rate'] = processed / elapsed
+                res['eta'] = max(res['planned'] - processed, 0) / res['rate']
+        return res
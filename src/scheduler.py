@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Coordination of all worker processes through Redis. Slots are leases
+# with an expiry time, so slots of a killed worker are freed eventually.
+
+import time
+import uuid
+
+
+class RedisSemaphore:
+    """Limit of concurrent holders across all worker processes."""
+
+    def __init__(self, redis, key, limit, lease=600, poll_interval=0.2):
+        self.redis = redis
+        self.key = key
+        self.limit = limit
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.tokens = []
+
+    def try_acquire(self):
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.redis.lock(self.key + ':lock', timeout=10):
+            self.redis.zremrangebyscore(self.key, '-inf', now)
+            if self.redis.zcard(self.key) >= self.limit:
+                return None
+            self.redis.zadd(self.key, {token: now + self.lease})
+        return token
+
+    def acquire(self):
+        while True:
+            token = self.try_acquire()
+            if token is not None:
+                return token
+            time.sleep(self.poll_interval)
+
+    def release(self, token):
+        self.redis.zrem(self.key, token)
+
+    def __enter__(self):
+        # one semaphore object is shared by the threads of a process
+        token = self.acquire()
+        self.tokens.append(token)
+        return token
+
+    def __exit__(self, *args):
+        self.release(self.tokens.pop())
+
+
+class WikiScheduler:
+    """Fair share of import slots between the wikis being imported.
+
+    Every active wiki gets slots in proportion to its priority. A wiki may
+    use more than its share only while no other wiki below its share is
+    waiting for a slot.
+    """
+
+    def __init__(self, redis, slots, lease=3600, waiting_timeout=60):
+        self.redis = redis
+        self.slots = slots
+        self.lease = lease
+        self.waiting_timeout = waiting_timeout
+        self.prefix = 'wiki_importer:scheduler'
+
+    def running_key(self, dbname):
+        return '%s:running:%s' % (self.prefix, dbname)
+
+    def activate(self, dbname, priority=1):
+        self.redis.hset(self.prefix + ':priorities', dbname, max(1, priority))
+
+    def deactivate(self, dbname):
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(self.prefix + ':priorities', dbname)
+            pipe.hdel(self.prefix + ':waiting', dbname)
+            pipe.delete(self.running_key(dbname))
+            pipe.execute()
+
+    def get_state(self, now):
+        priorities = {
+            dbname.decode('utf-8'): int(priority)
+            for dbname, priority in self.redis.hgetall(self.prefix + ':priorities').items()
+        }
+        waiting = {
+            dbname.decode('utf-8'): float(asked)
+            for dbname, asked in self.redis.hgetall(self.prefix + ':waiting').items()
+        }
+        running = {}
+        for dbname in priorities:
+            self.redis.zremrangebyscore(self.running_key(dbname), '-inf', now)
+            running[dbname] = self.redis.zcard(self.running_key(dbname))
+        return priorities, waiting, running
+
+    def get_share(self, dbname, priorities):
+        return max(1, self.slots * priorities.get(dbname, 1) // sum(priorities.values()))
+
+    def try_acquire(self, dbname):
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.redis.lock(self.prefix + ':lock', timeout=10):
+            priorities, waiting, running = self.get_state(now)
+            if dbname not in priorities:
+                # imported without the scheduler being told, e.g. by hand
+                priorities[dbname] = 1
+                running[dbname] = self.redis.zcard(self.running_key(dbname))
+            others_waiting = any(
+                running.get(other, 0) < self.get_share(other, priorities)
+                for other, asked in waiting.items()
+                if other != dbname and now - asked < self.waiting_timeout
+            )
+            allowed = sum(running.values()) < self.slots and (
+                running[dbname] < self.get_share(dbname, priorities) or not others_waiting
+            )
+            if not allowed:
+                self.redis.hset(self.prefix + ':waiting', dbname, now)
+                return None
+            self.redis.hdel(self.prefix + ':waiting', dbname)
+            self.redis.zadd(self.running_key(dbname), {token: now + self.lease})
+        return token
+
+    def release(self, dbname, token):
+        self.redis.zrem(self.running_key(dbname), token)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bz2
+import gzip
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIXES = {
+    'none': '.xml',
+    'gzip': '.xml.gz',
+    'zstd': '.xml.zst',
+}
+
+
+def get_compression(name):
+    # zstd is used only when the zstandard module is installed
+    if name == 'zstd' and zstandard is None:
+        return 'gzip'
+    if name not in SUFFIXES:
+        return 'none'
+    return name
+
+
+def get_suffix(compression):
+    return SUFFIXES[get_compression(compression)]
+
+
+def open_export(path, compression):
+    """Open an export file for writing text, compressed as configured."""
+    compression = get_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        return zstandard.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def open_raw(path):
+    if path.endswith(SUFFIXES['gzip']):
+        return gzip.open(path, 'rb')
+    if path.endswith(SUFFIXES['zstd']):
+        return zstandard.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def open_dump(path):
+    """Open an XML dump for binary reading, based on its extension."""
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+# Elements located by scan_export_page(). None of them can overlap another
+# and they never appear unescaped inside page content.
+EXPORT_TAGS_RE = re.compile(rb'<page>|<revision>|</mediawiki>')
+EXPORT_TAG_MAX = len(b'</mediawiki>')
+
+
+def scan_export_page(path, chunk_size=65536):
+    """Locate the <page> element of an export file without loading it.
+
+    Returns the offsets of its start and of the closing </mediawiki> tag in
+    the decompressed content, and its number of revisions. None if the
+    export has no page, e.g. for a missing page.
+    """
+    start = end = None
+    revisions = 0
+    offset = 0
+    buf = b''
+    with open_raw(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buf += chunk
+            last_end = 0
+            for match in EXPORT_TAGS_RE.finditer(buf):
+                tag = match.group()
+                if tag == b'<revision>':
+                    revisions += 1
+                elif tag == b'<page>':
+                    if start is None:
+                        start = offset + match.start()
+                else:
+                    end = offset + match.start()
+                last_end = match.end()
+            # keep the bytes a tag split between chunks may start in
+            cut = max(len(buf) - EXPORT_TAG_MAX + 1, last_end)
+            offset += cut
+            buf = buf[cut:]
+    if start is None or end is None:
+        return None
+    return start, end, revisions
+
+
+class ExportSlice:
+    """Binary file object of a range of the decompressed content of an
+    export file.
+
+    The file is open only while the range is being read, so a request body
+    can chain slices of many files.
+    """
+
+    def __init__(self, path, start, end):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.position = start
+        self.f = None
+
+    def read(self, size=-1):
+        remaining = self.end - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            self.close()
+            return b''
+        if self.f is None:
+            self.f = open_raw(self.path)
+            self.f.seek(self.position)
+        chunk = self.f.read(size)
+        if not chunk:
+            raise ValueError('%s ended before offset %d' % (self.path, self.end))
+        self.position += len(chunk)
+        return chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise ValueError('ExportSlice can only be rewound')
+        self.close()
+        self.position = self.start
+        return 0
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class ExportChain:
+    """Binary file object reading its parts one after another.
+
+    Parts are bytes or file objects with a length, like ExportSlice. Used
+    to upload pages of several export files as one export.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.current = 0
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+        res = []
+        while size > 0 and self.current < len(self.parts):
+            part = self.parts[self.current]
+            if isinstance(part, bytes):
+                chunk = part[self.offset:self.offset + size]
+                self.offset += len(chunk)
+            else:
+                chunk = part.read(size)
+            if not chunk:
+                self.current += 1
+                self.offset = 0
+                continue
+            res.append(chunk)
+            size -= len(chunk)
+        return b''.join(res)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise ValueError('ExportChain can only be rewound')
+        for part in self.parts:
+            if not isinstance(part, bytes):
+                part.seek(0)
+        self.current = 0
+        self.offset = 0
+        return 0
+
+    def close(self):
+        for part in self.parts:
+            if not isinstance(part, bytes):
+                part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)